@@ -3,20 +3,41 @@ Portfolio Management Service
 Tracks user holdings, P&L, positions, and portfolio performance
 """
 
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel
 from typing import List, Optional, Dict
 from datetime import datetime
-import json
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import functools
+import math
+import msgspec
 import os
-import yfinance as yf
+import orjson
+import sqlite3
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
 from collections import defaultdict
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Prepare the database on startup and flush it on shutdown"""
+    init_db()
+    yield
+    # Flush the write-ahead log into the database file
+    with _DB_LOCK:
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
 app = FastAPI(
     title="Portfolio Service",
     description="Portfolio management and tracking",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # CORS configuration
@@ -28,8 +49,69 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Data file
-PORTFOLIOS_FILE = "portfolios.json"
+# Data files
+PORTFOLIOS_DB = "portfolios.db"
+PORTFOLIOS_FILE = "portfolios.json"  # Legacy JSON store, imported into the database on first start
+
+# Database (shared connection, serialized by _DB_LOCK)
+db = sqlite3.connect(PORTFOLIOS_DB, check_same_thread=False, isolation_level=None)
+db.row_factory = sqlite3.Row
+db.execute("PRAGMA journal_mode=WAL")
+# With WAL, NORMAL only fsyncs at checkpoints, so commits do not wait on the disk
+db.execute("PRAGMA synchronous=NORMAL")
+db.execute("PRAGMA foreign_keys=ON")
+_DB_LOCK = threading.Lock()
+
+# Loaded portfolios (least recently used first), valid while PRAGMA data_version is unchanged
+PORTFOLIO_CACHE_SIZE = 1024
+_PORTFOLIO_CACHE = {"version": None, "data": {}}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS portfolios (
+    user_id TEXT PRIMARY KEY,
+    cash REAL NOT NULL,
+    total_cost_basis REAL NOT NULL DEFAULT 0.0,
+    next_txn_id INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS positions (
+    user_id TEXT NOT NULL REFERENCES portfolios (user_id),
+    ticker TEXT NOT NULL,
+    quantity REAL NOT NULL,
+    avg_cost_basis REAL NOT NULL,
+    added_at TEXT NOT NULL,
+    PRIMARY KEY (user_id, ticker)
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    user_id TEXT NOT NULL REFERENCES portfolios (user_id),
+    id TEXT NOT NULL,
+    ticker TEXT NOT NULL,
+    type TEXT NOT NULL,
+    quantity REAL NOT NULL,
+    price REAL NOT NULL,
+    timestamp TEXT NOT NULL,
+    fees REAL NOT NULL DEFAULT 0.0,
+    PRIMARY KEY (user_id, id)
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_user_timestamp ON transactions (user_id, timestamp);
+"""
+
+# Shared HTTP session so Yahoo requests reuse keep-alive connections
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=64))
+
+# Yahoo chart endpoint; its metadata carries the latest price
+YAHOO_CHART_URL = "https://query2.finance.yahoo.com/v8/finance/chart/{ticker}"
+YAHOO_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+}
+
+# Price cache: ticker -> (price, fetched_at)
+PRICE_CACHE_TTL = 30  # seconds
+_PRICE_CACHE: Dict[str, tuple] = {}
+_PRICE_CACHE_LOCK = threading.Lock()
+
+# yf.download keeps its results in module globals, so concurrent calls would overwrite each other
+_DOWNLOAD_LOCK = threading.Lock()
 
 # Models
 class Position(BaseModel):
@@ -71,71 +153,388 @@ class RemovePositionRequest(BaseModel):
     price: float
 
 # Helper functions
-def load_portfolios() -> Dict:
-    """Load portfolios from file"""
-    if os.path.exists(PORTFOLIOS_FILE):
-        with open(PORTFOLIOS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_portfolios(portfolios: Dict):
-    """Save portfolios to file"""
-    with open(PORTFOLIOS_FILE, 'w') as f:
-        json.dump(portfolios, f, indent=2)
+@contextmanager
+def db_transaction(user_id: Optional[str] = None):
+    """Run a block of statements as a single database transaction, evicting the written user's cached portfolio"""
+    with _DB_LOCK:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        # Our own commits do not bump data_version, so evict here (everything if no user is given)
+        if user_id is None:
+            _PORTFOLIO_CACHE["data"] = {}
+        else:
+            _PORTFOLIO_CACHE["data"].pop(user_id, None)
+
+def init_db():
+    """Create the schema and import the legacy JSON store if the database is empty"""
+    db.executescript(SCHEMA)
+
+    with db_transaction() as conn:
+        if conn.execute("SELECT 1 FROM portfolios LIMIT 1").fetchone():
+            return
+        if not os.path.exists(PORTFOLIOS_FILE):
+            return
+
+        with open(PORTFOLIOS_FILE, 'rb') as f:
+            portfolios = orjson.loads(f.read())
+
+        for user_id, portfolio in portfolios.items():
+            conn.execute(
+                "INSERT INTO portfolios (user_id, cash, total_cost_basis, next_txn_id) VALUES (?, ?, ?, ?)",
+                (
+                    user_id,
+                    portfolio['cash'],
+                    sum(p['quantity'] * p['avgCostBasis'] for p in portfolio['positions']),
+                    len(portfolio['transactions']) + 1
+                )
+            )
+            conn.executemany(
+                "INSERT INTO positions (user_id, ticker, quantity, avg_cost_basis, added_at) VALUES (?, ?, ?, ?, ?)",
+                [(user_id, p['ticker'], p['quantity'], p['avgCostBasis'], p['addedAt']) for p in portfolio['positions']]
+            )
+            conn.executemany(
+                "INSERT INTO transactions (user_id, id, ticker, type, quantity, price, timestamp, fees) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (user_id, t['id'], t['ticker'], t['type'], t['quantity'], t['price'], t['timestamp'], t.get('fees', 0.0))
+                    for t in portfolio['transactions']
+                ]
+            )
+
+def load_portfolio(user_id: str) -> Optional[Dict]:
+    """Load a user's portfolio, re-reading the database only after it has changed"""
+    with _DB_LOCK:
+        # data_version changes whenever another connection (e.g. another worker) commits
+        version = db.execute("PRAGMA data_version").fetchone()[0]
+        if version != _PORTFOLIO_CACHE["version"]:
+            _PORTFOLIO_CACHE["version"] = version
+            _PORTFOLIO_CACHE["data"] = {}
+
+        if user_id in _PORTFOLIO_CACHE["data"]:
+            # Move to the most recently used end
+            portfolio = _PORTFOLIO_CACHE["data"].pop(user_id)
+            _PORTFOLIO_CACHE["data"][user_id] = portfolio
+            return portfolio
+
+        row = db.execute("SELECT cash, total_cost_basis FROM portfolios WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+
+        positions = db.execute(
+            "SELECT ticker, quantity, avg_cost_basis AS avgCostBasis, added_at AS addedAt "
+            "FROM positions WHERE user_id = ? ORDER BY rowid",
+            (user_id,)
+        ).fetchall()
+        transactions = db.execute(
+            "SELECT id, ticker, type, quantity, price, timestamp, fees "
+            "FROM transactions WHERE user_id = ? ORDER BY rowid",
+            (user_id,)
+        ).fetchall()
+
+        portfolio = {
+            "userId": user_id,
+            "cash": row['cash'],
+            "totalCostBasis": row['total_cost_basis'],
+            "positions": [dict(position) for position in positions],
+            "transactions": [dict(transaction) for transaction in transactions]
+        }
+        if len(_PORTFOLIO_CACHE["data"]) >= PORTFOLIO_CACHE_SIZE:
+            del _PORTFOLIO_CACHE["data"][next(iter(_PORTFOLIO_CACHE["data"]))]
+        _PORTFOLIO_CACHE["data"][user_id] = portfolio
+
+    return portfolio
+
+def create_portfolio(user_id: str) -> Dict:
+    """Create a new portfolio with the starting cash balance"""
+    with db_transaction(user_id) as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO portfolios (user_id, cash) VALUES (?, ?)",
+            (user_id, 100000.0)  # Starting cash: $100,000
+        )
+    return load_portfolio(user_id)
+
+def next_transaction_id(conn: sqlite3.Connection, user_id: str) -> str:
+    """Take the next transaction id from the user's persisted counter"""
+    row = conn.execute(
+        "UPDATE portfolios SET next_txn_id = next_txn_id + 1 WHERE user_id = ? RETURNING next_txn_id - 1",
+        (user_id,)
+    ).fetchone()
+    return f"txn_{row[0]}"
+
+def record_buy(user_id: str, request: AddPositionRequest) -> str:
+    """Apply a buy to the user's portfolio, returning the transaction id"""
+    with db_transaction(user_id) as conn:
+        portfolio = conn.execute("SELECT cash FROM portfolios WHERE user_id = ?", (user_id,)).fetchone()
+
+        if portfolio is None:
+            raise HTTPException(status_code=404, detail="Portfolio not found")
+
+        # Calculate total cost
+        total_cost = request.quantity * request.price
+
+        # Check if enough cash
+        if portfolio['cash'] < total_cost:
+            raise HTTPException(status_code=400, detail="Insufficient funds")
+
+        # Deduct cash and add the lot to the running cost basis
+        conn.execute(
+            "UPDATE portfolios SET cash = cash - ?, total_cost_basis = total_cost_basis + ? WHERE user_id = ?",
+            (total_cost, total_cost, user_id)
+        )
+
+        # Create the position, or add to it and update its average cost basis, in one keyed upsert
+        conn.execute(
+            "INSERT INTO positions (user_id, ticker, quantity, avg_cost_basis, added_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_id, ticker) DO UPDATE SET "
+            "avg_cost_basis = (quantity * avg_cost_basis + excluded.quantity * excluded.avg_cost_basis) / (quantity + excluded.quantity), "
+            "quantity = quantity + excluded.quantity",
+            (user_id, request.ticker, request.quantity, request.price, datetime.utcnow().isoformat())
+        )
+
+        # Add transaction
+        transaction_id = next_transaction_id(conn, user_id)
+        conn.execute(
+            "INSERT INTO transactions (user_id, id, ticker, type, quantity, price, timestamp, fees) "
+            "VALUES (?, ?, ?, 'buy', ?, ?, ?, 0.0)",
+            (user_id, transaction_id, request.ticker, request.quantity, request.price, datetime.utcnow().isoformat())
+        )
+
+    return transaction_id
+
+def record_sell(user_id: str, request: RemovePositionRequest) -> str:
+    """Apply a sell to the user's portfolio, returning the transaction id"""
+    with db_transaction(user_id) as conn:
+        portfolio = conn.execute("SELECT cash FROM portfolios WHERE user_id = ?", (user_id,)).fetchone()
+
+        if portfolio is None:
+            raise HTTPException(status_code=404, detail="Portfolio not found")
+
+        # Take the shares out of the position in one keyed update
+        position = conn.execute(
+            "UPDATE positions SET quantity = quantity - ? "
+            "WHERE user_id = ? AND ticker = ? AND quantity >= ? RETURNING quantity, avg_cost_basis",
+            (request.quantity, user_id, request.ticker, request.quantity)
+        ).fetchone()
+
+        if position is None:
+            existing_position = conn.execute(
+                "SELECT 1 FROM positions WHERE user_id = ? AND ticker = ?",
+                (user_id, request.ticker)
+            ).fetchone()
+            if not existing_position:
+                raise HTTPException(status_code=404, detail="Position not found")
+            raise HTTPException(status_code=400, detail="Insufficient shares")
+
+        # Calculate proceeds
+        proceeds = request.quantity * request.price
+
+        # Add cash and release the cost basis of the shares sold
+        conn.execute(
+            "UPDATE portfolios SET cash = cash + ?, total_cost_basis = total_cost_basis - ? WHERE user_id = ?",
+            (proceeds, request.quantity * position['avg_cost_basis'], user_id)
+        )
+
+        # Remove the position once it is fully sold
+        if position['quantity'] == 0:
+            conn.execute("DELETE FROM positions WHERE user_id = ? AND ticker = ?", (user_id, request.ticker))
+
+            # With no positions left the cost basis is exactly zero; clear any rounding drift
+            if not conn.execute("SELECT 1 FROM positions WHERE user_id = ? LIMIT 1", (user_id,)).fetchone():
+                conn.execute("UPDATE portfolios SET total_cost_basis = 0.0 WHERE user_id = ?", (user_id,))
+
+        # Add transaction
+        transaction_id = next_transaction_id(conn, user_id)
+        conn.execute(
+            "INSERT INTO transactions (user_id, id, ticker, type, quantity, price, timestamp, fees) "
+            "VALUES (?, ?, ?, 'sell', ?, ?, ?, 0.0)",
+            (user_id, transaction_id, request.ticker, request.quantity, request.price, datetime.utcnow().isoformat())
+        )
+
+    return transaction_id
+
+def load_transactions(user_id: str, limit: int, offset: int) -> List[Dict]:
+    """Load a page of the user's transactions, newest first"""
+    with _DB_LOCK:
+        transactions = db.execute(
+            "SELECT id, ticker, type, quantity, price, timestamp, fees "
+            "FROM transactions WHERE user_id = ? ORDER BY timestamp DESC, rowid DESC LIMIT ? OFFSET ?",
+            (user_id, limit, offset)
+        ).fetchall()
+
+    return [dict(transaction) for transaction in transactions]
+
+def get_cached_price(ticker: str) -> Optional[float]:
+    """Get a price from the cache if it has not expired"""
+    with _PRICE_CACHE_LOCK:
+        entry = _PRICE_CACHE.get(ticker)
+    if entry and time.monotonic() - entry[1] < PRICE_CACHE_TTL:
+        return entry[0]
+    return None
+
+def cache_price(ticker: str, price: float):
+    """Store a fetched price in the cache (failed lookups are not cached)"""
+    if price:
+        with _PRICE_CACHE_LOCK:
+            _PRICE_CACHE[ticker] = (price, time.monotonic())
+
+@functools.lru_cache(maxsize=1)
+def get_yfinance():
+    """Import yfinance on first use; it pulls in pandas and is only needed to fetch prices"""
+    import yfinance
+    return yfinance
+
+def get_quote_price(ticker: str) -> float:
+    """Get the latest price from Yahoo's chart metadata without building a DataFrame"""
+    response = SESSION.get(
+        YAHOO_CHART_URL.format(ticker=ticker),
+        params={"range": "1d", "interval": "1d"},
+        headers=YAHOO_HEADERS,
+        timeout=10
+    )
+    response.raise_for_status()
+    meta = orjson.loads(response.content)['chart']['result'][0]['meta']
+    return float(meta['regularMarketPrice'])
 
 def get_current_price(ticker: str) -> float:
-    """Get current stock price from yfinance"""
+    """Get current stock price from Yahoo, falling back to the yfinance price history"""
+    cached = get_cached_price(ticker)
+    if cached is not None:
+        return cached
+
     try:
-        stock = yf.Ticker(ticker)
-        data = stock.history(period="1d")
-        if not data.empty:
-            return float(data['Close'].iloc[-1])
-        return 0.0
+        price = get_quote_price(ticker)
+    except Exception:
+        price = 0.0
+
+    try:
+        if not price > 0:
+            stock = get_yfinance().Ticker(ticker, session=SESSION)
+            data = stock.history(period="1d")
+            price = float(data['Close'].iloc[-1]) if not data.empty else 0.0
     except Exception as e:
         print(f"Error fetching price for {ticker}: {e}")
         return 0.0
 
-def calculate_portfolio_metrics(portfolio: Dict) -> Dict:
-    """Calculate portfolio metrics with current prices"""
-    total_market_value = portfolio['cash']
-    total_cost_basis = portfolio['cash']
-    
+    cache_price(ticker, price)
+    return price
+
+def get_current_prices(tickers: List[str]) -> Dict[str, float]:
+    """Get current stock prices for several tickers in a single batched yfinance request"""
+    prices = {}
+    for ticker in tickers:
+        cached = get_cached_price(ticker)
+        if cached is not None:
+            prices[ticker] = cached
+
+    missing = [ticker for ticker in tickers if ticker not in prices]
+    if not missing:
+        return prices
+
+    try:
+        with _DOWNLOAD_LOCK:
+            data = get_yfinance().download(missing, period="1d", group_by="ticker", threads=True, progress=False, session=SESSION)
+    except Exception as e:
+        print(f"Error fetching prices for {missing}: {e}")
+        data = None
+
+    if data is not None:
+        # yfinance upper-cases and de-duplicates tickers; a single symbol has no ticker level in its columns
+        single_symbol = len({ticker.upper() for ticker in missing}) == 1
+        for ticker in missing:
+            try:
+                closes = (data if single_symbol else data[ticker.upper()])['Close'].dropna()
+                if not closes.empty:
+                    prices[ticker] = float(closes.iloc[-1])
+                    cache_price(ticker, prices[ticker])
+            except Exception as e:
+                print(f"Error reading batched price for {ticker}: {e}")
+
+    # Fall back to a per-ticker fetch for anything the batch did not return
+    for ticker in missing:
+        if ticker not in prices:
+            prices[ticker] = get_current_price(ticker)
+
+    return prices
+
+def calculate_portfolio_metrics(portfolio: Dict, prices: Dict[str, float]) -> Dict:
+    """Calculate portfolio metrics with current prices, returning a new dict and leaving the stored portfolio untouched"""
+    # The stored cost basis total is internal and is not part of the response
+    response = {"userId": portfolio['userId'], "cash": portfolio['cash']}
+
+    # An all-cash portfolio is worth exactly its cash
+    if not portfolio['positions']:
+        return {
+            **response,
+            "positions": [],
+            "transactions": portfolio['transactions'],
+            "totalValue": portfolio['cash'],
+            "totalPL": 0.0,
+            "totalPLPercent": 0.0
+        }
+
+    # Cost basis only changes on buy/sell, so the running total is kept in the store
+    total_cost_basis = portfolio['cash'] + portfolio['totalCostBasis']
+
+    positions = []
     for position in portfolio['positions']:
         # Get current price
-        current_price = get_current_price(position['ticker'])
-        position['currentPrice'] = current_price
-        
+        current_price = prices[position['ticker']]
+
         # Calculate market value
         market_value = position['quantity'] * current_price
-        position['marketValue'] = market_value
-        
+
         # Calculate cost basis
         cost_basis = position['quantity'] * position['avgCostBasis']
-        
+
         # Calculate unrealized P&L
         unrealized_pl = market_value - cost_basis
-        position['unrealizedPL'] = unrealized_pl
-        position['unrealizedPLPercent'] = (unrealized_pl / cost_basis * 100) if cost_basis > 0 else 0
-        
-        total_market_value += market_value
-        total_cost_basis += cost_basis
-    
+
+        positions.append({
+            **position,
+            "currentPrice": current_price,
+            "marketValue": market_value,
+            "unrealizedPL": unrealized_pl,
+            "unrealizedPLPercent": (unrealized_pl / cost_basis * 100) if cost_basis > 0 else 0
+        })
+
+    # Single C-level, correctly rounded reduction instead of a running += total
+    total_market_value = portfolio['cash'] + math.fsum(position['marketValue'] for position in positions)
+
     # Calculate total P&L
-    portfolio['totalValue'] = total_market_value
-    portfolio['totalPL'] = total_market_value - total_cost_basis
-    portfolio['totalPLPercent'] = (portfolio['totalPL'] / total_cost_basis * 100) if total_cost_basis > 0 else 0
-    
-    return portfolio
+    total_pl = total_market_value - total_cost_basis
+
+    return {
+        **response,
+        "positions": positions,
+        "transactions": portfolio['transactions'],
+        "totalValue": total_market_value,
+        "totalPL": total_pl,
+        "totalPLPercent": (total_pl / total_cost_basis * 100) if total_cost_basis > 0 else 0
+    }
 
-def verify_token(authorization: Optional[str] = None) -> dict:
+async def verify_token(authorization: Optional[str] = None) -> dict:
     """Simple token verification (matches other services)"""
     # For development, accept any token
     # In production, verify JWT token
     return {"user_id": "user_1"}  # Mock user
 
+async def price_portfolio(portfolio: Dict) -> Dict:
+    """Fetch current prices off the event loop and calculate portfolio metrics"""
+    tickers = [position['ticker'] for position in portfolio['positions']]
+
+    # New and all-cash portfolios have nothing to price
+    prices = await asyncio.to_thread(get_current_prices, tickers) if tickers else {}
+
+    return calculate_portfolio_metrics(portfolio, prices)
+
 # Routes
 @app.get("/")
-def read_root():
+async def read_root():
     """Health check endpoint"""
     return {
         "service": "Portfolio Service",
@@ -143,160 +542,66 @@ def read_root():
         "version": "1.0.0"
     }
 
-@app.get("/api/portfolio", response_model=Portfolio)
-def get_portfolio(token_data: dict = Depends(verify_token)):
+# The response is built from trusted store data, so it is encoded directly rather than re-validated against Portfolio
+@app.get("/api/portfolio", response_model=None, responses={200: {"model": Portfolio}})
+async def get_portfolio(token_data: dict = Depends(verify_token)):
     """Get user's portfolio with current prices"""
     user_id = token_data.get("user_id")
-    portfolios = load_portfolios()
+    portfolio = await asyncio.to_thread(load_portfolio, user_id)
 
     # Initialize portfolio if doesn't exist
-    if user_id not in portfolios:
-        portfolios[user_id] = {
-            "userId": user_id,
-            "cash": 100000.0,  # Starting cash: $100,000
-            "positions": [],
-            "transactions": []
-        }
-        save_portfolios(portfolios)
+    if portfolio is None:
+        portfolio = await asyncio.to_thread(create_portfolio, user_id)
 
-    portfolio = portfolios[user_id]
-    portfolio = calculate_portfolio_metrics(portfolio)
+    portfolio = await price_portfolio(portfolio)
 
-    return portfolio
+    return Response(content=msgspec.json.encode(portfolio), media_type="application/json")
 
 @app.post("/api/portfolio/buy")
-def buy_stock(request: AddPositionRequest, token_data: dict = Depends(verify_token)):
+async def buy_stock(request: AddPositionRequest, token_data: dict = Depends(verify_token)):
     """Buy stock and add to portfolio"""
     user_id = token_data.get("user_id")
-    portfolios = load_portfolios()
-
-    if user_id not in portfolios:
-        raise HTTPException(status_code=404, detail="Portfolio not found")
-
-    portfolio = portfolios[user_id]
-
-    # Calculate total cost
-    total_cost = request.quantity * request.price
-
-    # Check if enough cash
-    if portfolio['cash'] < total_cost:
-        raise HTTPException(status_code=400, detail="Insufficient funds")
-
-    # Deduct cash
-    portfolio['cash'] -= total_cost
-
-    # Find existing position or create new
-    existing_position = None
-    for pos in portfolio['positions']:
-        if pos['ticker'] == request.ticker:
-            existing_position = pos
-            break
-
-    if existing_position:
-        # Update average cost basis
-        total_quantity = existing_position['quantity'] + request.quantity
-        total_cost_basis = (existing_position['quantity'] * existing_position['avgCostBasis']) + (request.quantity * request.price)
-        existing_position['avgCostBasis'] = total_cost_basis / total_quantity
-        existing_position['quantity'] = total_quantity
-    else:
-        # Add new position
-        portfolio['positions'].append({
-            "ticker": request.ticker,
-            "quantity": request.quantity,
-            "avgCostBasis": request.price,
-            "addedAt": datetime.utcnow().isoformat()
-        })
-
-    # Add transaction
-    transaction_id = f"txn_{len(portfolio['transactions']) + 1}"
-    portfolio['transactions'].append({
-        "id": transaction_id,
-        "ticker": request.ticker,
-        "type": "buy",
-        "quantity": request.quantity,
-        "price": request.price,
-        "timestamp": datetime.utcnow().isoformat(),
-        "fees": 0.0
-    })
 
-    save_portfolios(portfolios)
+    transaction_id = await asyncio.to_thread(record_buy, user_id, request)
 
     return {"message": "Stock purchased successfully", "transactionId": transaction_id}
 
 @app.post("/api/portfolio/sell")
-def sell_stock(request: RemovePositionRequest, token_data: dict = Depends(verify_token)):
+async def sell_stock(request: RemovePositionRequest, token_data: dict = Depends(verify_token)):
     """Sell stock from portfolio"""
     user_id = token_data.get("user_id")
-    portfolios = load_portfolios()
-
-    if user_id not in portfolios:
-        raise HTTPException(status_code=404, detail="Portfolio not found")
-
-    portfolio = portfolios[user_id]
-
-    # Find position
-    position = None
-    for pos in portfolio['positions']:
-        if pos['ticker'] == request.ticker:
-            position = pos
-            break
-
-    if not position:
-        raise HTTPException(status_code=404, detail="Position not found")
-
-    if position['quantity'] < request.quantity:
-        raise HTTPException(status_code=400, detail="Insufficient shares")
 
-    # Calculate proceeds
-    proceeds = request.quantity * request.price
-
-    # Add cash
-    portfolio['cash'] += proceeds
-
-    # Update or remove position
-    position['quantity'] -= request.quantity
-
-    if position['quantity'] == 0:
-        portfolio['positions'].remove(position)
-
-    # Add transaction
-    transaction_id = f"txn_{len(portfolio['transactions']) + 1}"
-    portfolio['transactions'].append({
-        "id": transaction_id,
-        "ticker": request.ticker,
-        "type": "sell",
-        "quantity": request.quantity,
-        "price": request.price,
-        "timestamp": datetime.utcnow().isoformat(),
-        "fees": 0.0
-    })
-
-    save_portfolios(portfolios)
+    transaction_id = await asyncio.to_thread(record_sell, user_id, request)
 
     return {"message": "Stock sold successfully", "transactionId": transaction_id}
 
 @app.get("/api/portfolio/transactions")
-def get_transactions(token_data: dict = Depends(verify_token)):
-    """Get transaction history"""
+async def get_transactions(
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    token_data: dict = Depends(verify_token)
+):
+    """Get transaction history, newest first, one page at a time"""
     user_id = token_data.get("user_id")
-    portfolios = load_portfolios()
 
-    if user_id not in portfolios:
-        return {"transactions": []}
+    # Fetch one extra row to tell whether another page follows
+    transactions = await asyncio.to_thread(load_transactions, user_id, limit + 1, offset)
 
-    return {"transactions": portfolios[user_id]['transactions']}
+    return {
+        "transactions": transactions[:limit],
+        "nextOffset": offset + limit if len(transactions) > limit else None
+    }
 
 @app.get("/api/portfolio/performance")
-def get_performance(token_data: dict = Depends(verify_token)):
+async def get_performance(token_data: dict = Depends(verify_token)):
     """Get portfolio performance metrics"""
     user_id = token_data.get("user_id")
-    portfolios = load_portfolios()
+    portfolio = await asyncio.to_thread(load_portfolio, user_id)
 
-    if user_id not in portfolios:
+    if portfolio is None:
         raise HTTPException(status_code=404, detail="Portfolio not found")
 
-    portfolio = portfolios[user_id]
-    portfolio = calculate_portfolio_metrics(portfolio)
+    portfolio = await price_portfolio(portfolio)
 
     # Calculate additional metrics
     initial_value = 100000.0  # Starting cash